@@ -2,11 +2,13 @@ import sys
 import pandas as pd
 from pandasDataModel import PandasModel
 from customProxyModel import CustomProxyModel
+from tradeAggregation import AggregationCache, AGGREGATION_RULES, AGGREGATION_WIDTHS, drawdown
+from monteCarlo import MonteCarloWorker
 import numpy as np
-from PyQt5.QtCore import Qt, QSortFilterProxyModel
+from PyQt5.QtCore import Qt, QSortFilterProxyModel, QThread
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QLineEdit, QCheckBox, QTableView,
-    QFileDialog, QLabel, QSplitter, QSizePolicy, QComboBox, QHeaderView
+    QFileDialog, QLabel, QSplitter, QSizePolicy, QComboBox, QHeaderView, QSpinBox, QProgressBar
 )
 from matplotlib.backend_bases import MouseEvent, Event
 from matplotlib.lines import Line2D
@@ -102,7 +104,7 @@ class MainWindow(QMainWindow):
         plot_mode_label = QLabel("Plot Mode:")
         self.plot_mode_combo = QComboBox()
         # Style, Contents and defaults
-        self.plot_mode_combo.addItems(["Individual", "Cumulative"])
+        self.plot_mode_combo.addItems(["Individual", "Cumulative", "Drawdown"])
         self.plot_mode_combo.setStyleSheet("background-color: white; color: black;")
         # Add to sidebar layout manager
         sidebar_layout.addWidget(plot_mode_label)
@@ -156,6 +158,24 @@ class MainWindow(QMainWindow):
         # endregion
         """---X-Axis Combobox---"""
 
+        """---Aggregation Combobox---"""
+        # region Aggregation Combobox
+
+        # Init Objects
+        aggregation_label = QLabel("Aggregation:")
+        self.aggregation_combo = QComboBox()
+        # Style, Contents and Defaults
+        self.aggregation_combo.addItems(["None"] + list(AGGREGATION_RULES))
+        self.aggregation_combo.setStyleSheet("background-color: white; color: black;")
+        # Add to sidebar layout manager
+        sidebar_layout.addWidget(aggregation_label)
+        sidebar_layout.addWidget(self.aggregation_combo)
+        # Connections
+        self.aggregation_combo.currentIndexChanged.connect(self.update_aggregation)
+
+        # endregion
+        """---Aggregation Combobox---"""
+
         """---Direction Filter---"""
         # region Direction Filter
 
@@ -177,6 +197,36 @@ class MainWindow(QMainWindow):
         # endregion
         """---Direction Filter---"""
 
+        """---Monte Carlo---"""
+        # region Monte Carlo
+
+        # Init Objects
+        monte_carlo_label = QLabel("Monte Carlo:")
+        self.mc_method_combo = QComboBox()
+        self.mc_paths_spinbox = QSpinBox()
+        self.mc_run_button = QPushButton("Run Monte Carlo")
+        self.mc_progress_bar = QProgressBar()
+        # Style, Contents and Defaults
+        self.mc_method_combo.addItems(["Shuffle", "Bootstrap"])
+        self.mc_method_combo.setStyleSheet("background-color: white; color: black;")
+        self.mc_paths_spinbox.setRange(100, 100000)
+        self.mc_paths_spinbox.setSingleStep(1000)
+        self.mc_paths_spinbox.setValue(5000)
+        self.mc_paths_spinbox.setSuffix(" paths")
+        self.mc_paths_spinbox.setStyleSheet("background-color: white; color: black;")
+        self.mc_progress_bar.setValue(0)
+        # Add to sidebar layout manager
+        sidebar_layout.addWidget(monte_carlo_label)
+        sidebar_layout.addWidget(self.mc_method_combo)
+        sidebar_layout.addWidget(self.mc_paths_spinbox)
+        sidebar_layout.addWidget(self.mc_run_button)
+        sidebar_layout.addWidget(self.mc_progress_bar)
+        # Connections
+        self.mc_run_button.clicked.connect(self.toggle_monte_carlo)
+
+        # endregion
+        """---Monte Carlo---"""
+
         # Stretch at the end
         sidebar_layout.addStretch()
 
@@ -283,6 +333,13 @@ class MainWindow(QMainWindow):
         self.model = PandasModel()
         self.x_axis_mode = "consecutive"
         self.plot_mode = "Individual"
+        self.aggregation = "None"
+        self.aggregation_cache = AggregationCache()
+        self.aggregated_df = pd.DataFrame()
+        self.mc_thread = None
+        self.mc_worker = None
+        self.mc_result = None
+        self.mc_key = None
         self.proxy_model = CustomProxyModel()
         self.proxy_model.setSortRole(Qt.EditRole)
         self.proxy_model.setSourceModel(self.model)
@@ -303,6 +360,10 @@ class MainWindow(QMainWindow):
         self.plot_mode = self.plot_mode_combo.currentText()
         self.plot_data()
 
+    def update_aggregation(self):
+        self.aggregation = self.aggregation_combo.currentText()
+        self.plot_data()
+
     def toggle_sidebar(self):
         self.sidebar.setVisible(not self.sidebar.isVisible())
 
@@ -317,6 +378,12 @@ class MainWindow(QMainWindow):
                     self.df['Open Time'] = pd.to_datetime(self.df['Open Time'])
                 if 'Close Time' in self.df.columns:
                     self.df['Close Time'] = pd.to_datetime(self.df['Close Time'])
+                self.aggregation_cache.clear()
+                # Results of the previous file, or of a run still in progress, must not be drawn over the new data
+                if self.mc_worker is not None:
+                    self.mc_worker.cancel()
+                self.mc_result = None
+                self.mc_key = None
                 self.model.set_data_frame(self.df)
                 header = self.table_view.horizontalHeader()
                 last_col_index = self.model.columnCount() - 1
@@ -345,6 +412,101 @@ class MainWindow(QMainWindow):
 
         self.plot_data()
 
+    def _get_plotted_indices(self):
+        # Determine which rows to plot based on filters and checkboxes
+        visible_source_indices = {self.proxy_model.mapToSource(self.proxy_model.index(row, 0)).row()
+                                  for row in range(self.proxy_model.rowCount())}
+        checked_mask = self.model.get_checked_rows_mask()
+        return [i for i, is_checked in enumerate(checked_mask) if is_checked and i in visible_source_indices]
+
+    def _get_value_columns(self):
+        # DataFrame columns summed up per trade, matching the plot column checkboxes
+        value_columns = []
+        if self.balance_checkbox.isChecked():
+            value_columns.append('Profit')
+        if self.swap_checkbox.isChecked():
+            value_columns.append('Swap')
+        if self.commission_checkbox.isChecked():
+            value_columns.append('Commission')
+        return value_columns
+
+    @staticmethod
+    def _get_trade_values(trades, value_columns):
+        # Per-trade sum of the given columns, missing values count as 0
+        values = np.zeros(len(trades))
+        for column in value_columns:
+            values += trades[column].fillna(0).to_numpy(dtype=float)
+        return values
+
+    def toggle_monte_carlo(self):
+        # -- Start / Cancel Monte Carlo --
+        # Runs the simulation on the currently filtered and checked trades in a background thread.
+        if self.mc_worker is not None:
+            # The button is enabled again once the thread has finished
+            self.mc_worker.cancel()
+            self.mc_run_button.setText("Cancelling...")
+            self.mc_run_button.setEnabled(False)
+            return
+
+        if self.df.empty:
+            return
+        indices = self._get_plotted_indices()
+        value_columns = self._get_value_columns()
+        if len(indices) < 2 or not value_columns:
+            return
+
+        try:
+            values = self._get_trade_values(self.df.iloc[indices], value_columns)
+        except KeyError as e:
+            print(f"Failed to start Monte Carlo, column not found: {e}")
+            return
+
+        # Make sure a previous thread has fully stopped before it is replaced
+        if self.mc_thread is not None:
+            self.mc_thread.wait()
+
+        self.mc_result = None
+        self.mc_key = (tuple(indices), tuple(value_columns))
+        self.mc_worker = MonteCarloWorker(values, n_paths=self.mc_paths_spinbox.value(),
+                                          method=self.mc_method_combo.currentText())
+        self.mc_thread = QThread()
+        self.mc_worker.moveToThread(self.mc_thread)
+        # Connections
+        self.mc_thread.started.connect(self.mc_worker.run)
+        self.mc_worker.progress.connect(self._monte_carlo_progress)
+        self.mc_worker.finished.connect(self._monte_carlo_finished)
+        self.mc_worker.failed.connect(self._monte_carlo_failed)
+        for signal in (self.mc_worker.finished, self.mc_worker.cancelled, self.mc_worker.failed):
+            signal.connect(self.mc_thread.quit)
+        self.mc_thread.finished.connect(self._monte_carlo_stopped)
+
+        self.mc_run_button.setText("Cancel Monte Carlo")
+        self.mc_progress_bar.setValue(0)
+        self.mc_thread.start()
+
+    def _monte_carlo_progress(self, done, total):
+        self.mc_progress_bar.setMaximum(total)
+        self.mc_progress_bar.setValue(done)
+
+    def _monte_carlo_finished(self, result):
+        # mc_key is reset when a new CSV is loaded, the result then belongs to the old data
+        if self.mc_key is None:
+            return
+        self.mc_result = result
+        # The bands cannot be drawn per trade in Individual mode, switch to the equity view to show them
+        if self.plot_mode == "Individual":
+            self.plot_mode_combo.setCurrentText("Cumulative")
+        else:
+            self.plot_data()
+
+    def _monte_carlo_failed(self, message):
+        print(f"Monte Carlo failed: {message}")
+
+    def _monte_carlo_stopped(self):
+        self.mc_worker = None
+        self.mc_run_button.setText("Run Monte Carlo")
+        self.mc_run_button.setEnabled(True)
+
     def plot_data(self):
         # -- Plot Data --
         # Redraws the plot based on the current data and user selections.
@@ -354,30 +516,18 @@ class MainWindow(QMainWindow):
                                       bbox=dict(boxstyle="round", fc="w"),
                                       arrowprops=dict(arrowstyle="->"))
         self.annot.set_visible(False)
+        # Only set again when the aggregated line is plotted, the hover annotation reads from it
+        self.aggregated_df = pd.DataFrame()
 
         if not self.df.empty:
-            # Determine which rows to plot based on filters and checkboxes
-            visible_source_indices = {self.proxy_model.mapToSource(self.proxy_model.index(row, 0)).row()
-                                      for row in range(self.proxy_model.rowCount())}
-            checked_mask = self.model.get_checked_rows_mask()
-            indices_to_plot = [i for i, is_checked in enumerate(checked_mask) if
-                               is_checked and i in visible_source_indices]
+            indices_to_plot = self._get_plotted_indices()
             plotted_df = self.df.iloc[indices_to_plot]
 
             if not plotted_df.empty:
                 try:
-                    y_values = pd.Series(np.zeros(len(plotted_df)), index=plotted_df.index)
-                    selected_columns = []
-
-                    if self.balance_checkbox.isChecked():
-                        y_values += plotted_df['Profit'].fillna(0)
-                        selected_columns.append('Balance')
-                    if self.swap_checkbox.isChecked():
-                        y_values += plotted_df['Swap'].fillna(0)
-                        selected_columns.append('Swap')
-                    if self.commission_checkbox.isChecked():
-                        y_values += plotted_df['Commission'].fillna(0)
-                        selected_columns.append('Commission')
+                    value_columns = self._get_value_columns()
+                    selected_columns = ['Balance' if column == 'Profit' else column for column in value_columns]
+                    y_values = pd.Series(self._get_trade_values(plotted_df, value_columns), index=plotted_df.index)
 
                     if not selected_columns:
                         self.line = Line2D([0], [0])
@@ -386,6 +536,13 @@ class MainWindow(QMainWindow):
                         self.canvas.draw()
                         return
 
+                    if self.aggregation != "None":
+                        self._plot_aggregated(indices_to_plot, selected_columns, plotted_df, y_values)
+                        if self.mc_result is not None and self.mc_key == (tuple(indices_to_plot), tuple(value_columns)):
+                            self._plot_monte_carlo_text("Monte Carlo bands are shown without aggregation")
+                        self.canvas.draw()
+                        return
+
                     # Determine x_values based on the selected mode
                     x_label = ""
                     x_values = ""
@@ -404,6 +561,9 @@ class MainWindow(QMainWindow):
                     if self.plot_mode == "Cumulative":
                         y_values = y_values.cumsum()
                         title = f"Cumulative {title}"
+                    elif self.plot_mode == "Drawdown":
+                        y_values = pd.Series(drawdown(y_values.cumsum()), index=y_values.index)
+                        title = f"Drawdown of {title}"
 
                     self.line, = self.ax.plot(x_values,
                                               y_values,
@@ -411,6 +571,10 @@ class MainWindow(QMainWindow):
                                               markersize=3,
                                               linestyle='-',
                                               color='skyblue')
+                    if self.plot_mode == "Drawdown":
+                        self.ax.fill_between(x_values, y_values, 0, color='salmon', alpha=0.4)
+                    if self.mc_key == (tuple(indices_to_plot), tuple(value_columns)):
+                        self._plot_monte_carlo_bands(x_values)
                     self.ax.set_title(title)
                     self.ax.grid(True)
 
@@ -432,6 +596,79 @@ class MainWindow(QMainWindow):
 
         self.canvas.draw()
 
+    def _plot_aggregated(self, indices_to_plot, selected_columns, plotted_df, y_values):
+        # -- Plot Aggregated Data --
+        # Plots the trades bucketed by the selected granularity, per-bucket P&L, equity or drawdown.
+        if self.x_axis_mode == "opening time":
+            time_column, x_label = 'Open Time', "Opening Time"
+        else:
+            # Profits are realized on close, so the consecutive mode also buckets by closing time
+            time_column, x_label = 'Close Time', "Closing Time"
+
+        self.aggregated_df = self.aggregation_cache.get(indices_to_plot, selected_columns, time_column,
+                                                        self.aggregation, plotted_df[time_column], y_values)
+        x_values = self.aggregated_df.index.to_numpy()
+        title = f"Plot of {', '.join(selected_columns)} per {self.aggregation} vs {x_label}"
+
+        if self.plot_mode == "Cumulative":
+            y_values = self.aggregated_df['Equity'].to_numpy()
+            title = f"Cumulative {title}"
+        elif self.plot_mode == "Drawdown":
+            y_values = self.aggregated_df['Drawdown'].to_numpy()
+            title = f"Drawdown of {title}"
+        else:
+            y_values = self.aggregated_df['P&L'].to_numpy()
+            colors = np.where(y_values >= 0, 'mediumseagreen', 'salmon')
+            self.ax.bar(x_values, y_values, width=AGGREGATION_WIDTHS[self.aggregation] * 0.8, align='edge',
+                        color=colors)
+
+        self.line, = self.ax.plot(x_values,
+                                  y_values,
+                                  marker='o',
+                                  markersize=3,
+                                  linestyle='None' if self.plot_mode == "Individual" else '-',
+                                  color='skyblue')
+        if self.plot_mode == "Drawdown":
+            self.ax.fill_between(x_values, y_values, 0, color='salmon', alpha=0.4)
+        self.ax.set_title(title)
+        self.ax.grid(True)
+        self.figure.autofmt_xdate()
+
+    def _plot_monte_carlo_bands(self, x_values):
+        # -- Plot Monte Carlo Bands --
+        # Overlays the simulated percentile bands on the realized equity or drawdown curve.
+        if self.mc_result is None:
+            return
+        if self.plot_mode == "Individual":
+            self._plot_monte_carlo_text("Monte Carlo bands are shown in Cumulative and Drawdown mode")
+            return
+
+        if self.plot_mode == "Cumulative":
+            bands = self.mc_result["equity_bands"]
+        else:
+            bands = self.mc_result["drawdown_bands"]
+        p = self.mc_result["percentiles"]
+
+        self.ax.fill_between(x_values, bands[0], bands[4], color='gray', alpha=0.15, label=f"P{p[0]}-P{p[4]}")
+        self.ax.fill_between(x_values, bands[1], bands[3], color='gray', alpha=0.3, label=f"P{p[1]}-P{p[3]}")
+        self.ax.plot(x_values, bands[2], linestyle='--', color='dimgray', label="Median")
+        self.ax.legend(loc='upper left', title=f"{self.mc_result['method']}, {self.mc_result['n_paths']} paths")
+
+        final = self.mc_result["final_balance"]
+        max_dd = self.mc_result["max_drawdown"]
+        if self.mc_result["method"] == "Shuffle":
+            # Every shuffled path contains the same trades, so all of them end on the same balance
+            summary = "\n".join([f"Final {final[0]:.2f} (same for every shuffle)"] +
+                                 [f"P{q}: Max DD {d:.2f}" for q, d in zip(p, max_dd)])
+        else:
+            summary = "\n".join([f"P{q}: Final {f:.2f}, Max DD {d:.2f}" for q, f, d in zip(p, final, max_dd)])
+        self._plot_monte_carlo_text(summary)
+
+    def _plot_monte_carlo_text(self, text):
+        # Monte Carlo summary or the reason why the bands are not drawn in the current view
+        self.ax.text(0.99, 0.02, text, ha="right", va="bottom", fontsize=8, transform=self.ax.transAxes,
+                     bbox=dict(boxstyle="round", fc="w", alpha=0.6))
+
     def update_annot(self, ind):
         # -- Update Annotation --
         # Updates the annotation text and position when hovering over a data point.
@@ -447,7 +684,11 @@ class MainWindow(QMainWindow):
 
         self.annot.xy = (numeric_x_val, y_val)
 
-        if self.x_axis_mode == "consecutive":
+        if self.aggregation != "None" and not self.aggregated_df.empty:
+            date_str = num2date(numeric_x_val).strftime('%Y-%m-%d %H:%M')
+            trades = int(self.aggregated_df['Trades'].iloc[idx])
+            text = f"{self.aggregation} of {date_str}\nTrades: {trades}\nValue: {y_val:.2f}"
+        elif self.x_axis_mode == "consecutive":
             x_label = "Trade Number"
             text = f"{x_label}: {int(raw_x_val)}\nValue: {y_val:.2f}"
         elif self.x_axis_mode in ["opening time", "closing time"]:
@@ -508,6 +749,15 @@ class MainWindow(QMainWindow):
                 self.annot.set_visible(False)
                 self.canvas.draw_idle()
 
+    def closeEvent(self, event):
+        """Called automatically when the window is closed."""
+        # Stop a running Monte Carlo simulation before the thread is destroyed
+        if self.mc_worker is not None:
+            self.mc_worker.cancel()
+        if self.mc_thread is not None:
+            self.mc_thread.wait()
+        super().closeEvent(event)
+
     def showEvent(self, event):
         """Called automatically when the window is shown."""
         # Set focus to the main window to deselect any input widgets
@@ -0,0 +1,109 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+import os
+import numpy as np
+from PyQt5.QtCore import QObject, pyqtSignal
+from tradeAggregation import drawdown
+
+
+# Percentiles drawn as bands, outer pair, inner pair and median
+BAND_PERCENTILES = [5, 25, 50, 75, 95]
+
+# Upper bound of full paths kept over all batches for the per-step bands, keeps memory and IPC independent of n_paths
+MAX_BAND_PATHS = 2000
+
+# Matrix elements (paths x trades) simulated per batch, bounds the memory of every worker independent of n_trades
+BATCH_ELEMENTS = 1_000_000
+
+
+def simulate_batch(values, n_paths, n_band_paths, method, seed_sequence):
+    """Simulate a batch of equity paths from the per-trade values as one matrix.
+
+    'Shuffle' reorders all trades per path, 'Bootstrap' draws the trades with replacement.
+    Only the final balance and max drawdown of every path leave the worker process, plus the equity and drawdown
+    of the first n_band_paths paths, which are already randomly ordered, for the per-step bands.
+    """
+    rng = np.random.default_rng(seed_sequence)
+    n_trades = len(values)
+    if method == "Bootstrap":
+        indices = rng.integers(0, n_trades, size=(n_paths, n_trades))
+    else:
+        indices = rng.permuted(np.tile(np.arange(n_trades), (n_paths, 1)), axis=1)
+
+    equity = values[indices]
+    del indices
+    np.cumsum(equity, axis=1, out=equity)
+    path_drawdown = drawdown(equity, axis=1)
+    return (equity[:, -1], path_drawdown.min(axis=1),
+            equity[:n_band_paths].astype(np.float32), path_drawdown[:n_band_paths].astype(np.float32))
+
+
+class MonteCarloWorker(QObject):
+    """Runs the Monte Carlo simulation in batches on a process pool, meant to be moved to a QThread."""
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(dict)
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, values, n_paths=5000, method="Shuffle", seed=None):
+        super().__init__()
+        self._values = np.asarray(values, dtype=float)
+        self._n_paths = n_paths
+        self._method = method
+        self._batch_size = max(1, BATCH_ELEMENTS // len(self._values))
+        self._seed = seed
+        self._cancel_requested = False
+
+    def cancel(self):
+        # Called from the GUI thread, checked between batches
+        self._cancel_requested = True
+
+    def run(self):
+        try:
+            batch_sizes = [min(self._batch_size, self._n_paths - start)
+                           for start in range(0, self._n_paths, self._batch_size)]
+            band_sizes = [-(-size * MAX_BAND_PATHS // self._n_paths) for size in batch_sizes]
+            seeds = np.random.SeedSequence(self._seed).spawn(len(batch_sizes))
+            final_balances, max_drawdowns, equities, drawdowns = [], [], [], []
+            done = 0
+            # The band percentiles are reported as one more step after all paths are simulated
+            total = self._n_paths + 1
+            self.progress.emit(done, total)
+
+            # Forking the multi-threaded Qt process can deadlock, spawned workers start from a clean interpreter
+            with ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                     mp_context=multiprocessing.get_context("spawn")) as executor:
+                pending = {executor.submit(simulate_batch, self._values, size, band_size, self._method, seed)
+                           for size, band_size, seed in zip(batch_sizes, band_sizes, seeds)}
+                while pending and not self._cancel_requested:
+                    completed, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        final_balance, max_drawdown, equity, path_drawdown = future.result()
+                        final_balances.append(final_balance)
+                        max_drawdowns.append(max_drawdown)
+                        equities.append(equity)
+                        drawdowns.append(path_drawdown)
+                        done += len(final_balance)
+                    if completed:
+                        self.progress.emit(done, total)
+                if self._cancel_requested:
+                    executor.shutdown(wait=False, cancel_futures=True)
+
+            # Emitted only once the pool has shut down, so the GUI never waits on running batches afterwards
+            if self._cancel_requested:
+                self.cancelled.emit()
+                return
+
+            result = {
+                "method": self._method,
+                "n_paths": self._n_paths,
+                "percentiles": BAND_PERCENTILES,
+                "equity_bands": np.percentile(np.concatenate(equities), BAND_PERCENTILES, axis=0),
+                "drawdown_bands": np.percentile(np.concatenate(drawdowns), BAND_PERCENTILES, axis=0),
+                "final_balance": np.percentile(np.concatenate(final_balances), BAND_PERCENTILES),
+                "max_drawdown": np.percentile(np.concatenate(max_drawdowns), BAND_PERCENTILES),
+            }
+            self.progress.emit(total, total)
+            self.finished.emit(result)
+        except Exception as e:
+            self.failed.emit(str(e))
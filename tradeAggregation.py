@@ -0,0 +1,68 @@
+import pandas as pd
+import numpy as np
+
+
+# Resample rules per granularity, buckets are labelled by their start
+AGGREGATION_RULES = {
+    "Hour": "h",
+    "Day": "D",
+    "Week": "W-MON",
+    "Month": "MS",
+}
+
+# Approximate bucket widths in days, used as bar widths on a date axis
+AGGREGATION_WIDTHS = {
+    "Hour": 1 / 24,
+    "Day": 1,
+    "Week": 7,
+    "Month": 30,
+}
+
+
+def drawdown(equity, axis=-1):
+    """Distance of the equity to its running peak along the given axis, starting from a flat balance of 0."""
+    equity = np.asarray(equity, dtype=float)
+    return equity - np.maximum(np.maximum.accumulate(equity, axis=axis), 0)
+
+
+def aggregate_trades(times, values, granularity):
+    """Bucket per-trade values by time and derive P&L, equity and drawdown per bucket.
+
+    Returns a DataFrame indexed by bucket start with the columns 'P&L', 'Trades', 'Equity' and 'Drawdown'.
+    Empty buckets are dropped, they would not change the equity or drawdown curve.
+    """
+    rule = AGGREGATION_RULES[granularity]
+    series = pd.Series(np.asarray(values, dtype=float), index=pd.DatetimeIndex(times))
+    series = series[series.index.notna()]
+
+    buckets = series.resample(rule, closed="left", label="left").agg(["sum", "count"])
+    buckets = buckets[buckets["count"] > 0]
+    buckets.columns = ["P&L", "Trades"]
+
+    equity = buckets["P&L"].cumsum().to_numpy()
+    buckets["Equity"] = equity
+    buckets["Drawdown"] = drawdown(equity)
+    return buckets
+
+
+class AggregationCache:
+    """Caches aggregated buckets per filter/check state, so switching the granularity does not recompute."""
+
+    def __init__(self, max_entries=32):
+        self._max_entries = max_entries
+        self._cache = {}
+
+    def clear(self):
+        self._cache.clear()
+
+    def get(self, rows, columns, time_column, granularity, times, values):
+        """Return the buckets for the given state, the times and per-trade values are only used on a cache miss."""
+        key = (tuple(rows), tuple(columns), time_column, granularity)
+        buckets = self._cache.get(key)
+        if buckets is None:
+            buckets = aggregate_trades(times, values, granularity)
+            # Drop the oldest entry once full, dicts keep insertion order
+            if len(self._cache) >= self._max_entries:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[key] = buckets
+        return buckets